@@ -1,7 +1,9 @@
 """
 module to retrieve and compare heroku env vars from a list of heroku apps
-requires that: 1) HEROKU_API_KEY be set, valid and saved in env vars; 2) heroku cli be installed
+requires that: 1) HEROKU_API_KEY be set, valid and saved in env vars; 2) curl be installed, for the
+fallback used when a Heroku request through python requests fails
 """
+import atexit
 import logging
 import os
 import subprocess
@@ -9,10 +11,15 @@ import os
 import json
 import pandas as pd
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
+import orjson
 import pandas as pd
 import requests
-from requests import Session, Request
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
 
 # Constants
 CIRCLECI_PERSONAL_API_TOKEN = os.environ.get("CIRCLECI_PERSONAL_API_TOKEN")
@@ -23,6 +30,21 @@ CURL_CLI_TEST_CMD = '''curl -nX GET https://api.heroku.com/apps/urban-robot-dev/
 HEROKU_API_TOKEN = HEROKU_API_KEY = os.environ.get(
     "HEROKU_API_KEY")  # https://devcenter.heroku.com/articles/platform-api-quickstart
 HEROKU_APPS = ["urban-robot-dev", "urban-robot-staging", "urban-robot"]
+# Heroku API headers, built once at import; None when HEROKU_API_KEY is not set
+_HEROKU_HEADERS = {
+    "Accept": "application/vnd.heroku+json; version=3",
+    "Authorization": f"Bearer {HEROKU_API_TOKEN.strip()}",
+    # None drops the session defaults for these, as the original prepared-request workaround did
+    "User-Agent": None,
+    "Accept-Encoding": None,
+    "Connection": None,
+} if HEROKU_API_TOKEN is not None else None
+NOT_SET = "not_set"  # placeholder for a var that a given source does not define
+HTTP_TIMEOUT = 10  # seconds, applied to every Heroku / CircleCI API call
+MAX_CONCURRENT_FETCHES = 8  # worker threads, and keep-alive connections pooled per host
+# transient Heroku / CircleCI failures are retried in-process, with backoff, on the pooled connection
+HTTP_RETRY = Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504),
+                   allowed_methods=("GET",))
 REQUIRED_ENV_VARS = [
     "AWS_ACCESS_KEY_ID",
     "AWS_DEFAULT_REGION",
@@ -54,13 +76,39 @@ REQUIRED_ENV_VARS = [
     "WEB_CONCURRENCY",
     "DAEMON_CONCURRENCY"
 ]
+# built once: hashed membership tests, and the sorted row index shared by local + matrix output
+_REQUIRED_SET = frozenset(REQUIRED_ENV_VARS)
+_REQUIRED_INDEX = pd.Index(sorted(REQUIRED_ENV_VARS))
+# the REQUIRED_ENV_VARS column only ever holds these two flags
+_REQUIRED_FLAG_DTYPE = pd.CategoricalDtype(["Yes", NOT_SET])
+
+# session shared by all Heroku + CircleCI calls; auth headers stay per-request so the
+# Heroku bearer token is never sent to CircleCI
+_SESSION = requests.Session()
+# pool_maxsize matches the fetch fanout so every worker gets a reusable connection
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONCURRENT_FETCHES,
+                                       max_retries=HTTP_RETRY))
+atexit.register(_SESSION.close)
+
+
+def _decode_json(response):
+    """
+    decode a JSON response body with orjson
+    raises requests' JSONDecodeError on a bad body, as response.json() does,
+    so callers catching requests.RequestException still handle it
+    """
+    try:
+        return orjson.loads(response.content)
+    except orjson.JSONDecodeError as e:
+        raise requests.exceptions.JSONDecodeError(e.msg, e.doc, e.pos, response=response) from e
 
 
 def get_local_env_vars():
     """pull all local env vars into a dataframe"""
-    env_vars_data = {var: os.getenv(var) for var in REQUIRED_ENV_VARS}
-    # Convert the dictionary to a pandas DataFrame
-    df_env_vars = pd.DataFrame.from_dict(env_vars_data, orient='index', columns=['local']).sort_index()
+    env = os.environ
+    env_vars_data = {var: env.get(var) for var in _REQUIRED_INDEX}
+    # values are already in _REQUIRED_INDEX order, so the frame needs no alignment or sort
+    df_env_vars = pd.Series(list(env_vars_data.values()), index=_REQUIRED_INDEX, name='local').to_frame()
     return df_env_vars, env_vars_data
 
 
@@ -85,6 +133,7 @@ def get_heroku_env_vars_with_curl(app_name="urban-robot-dev"):
     curl_cmd = [
         "curl",
         "-s",       # Silent mode
+        "-f",       # non-zero exit on HTTP errors, so error bodies are not parsed as config vars
         "-X", "GET", # GET request
         "-H", f"Accept: application/vnd.heroku+json; version=3",
         "-H", f"Authorization: Bearer {HEROKU_API_TOKEN.strip()}",
@@ -101,10 +150,10 @@ def get_heroku_env_vars_with_curl(app_name="urban-robot-dev"):
             df = pd.DataFrame.from_dict(config_vars, orient="index", columns=[app_name])
             return df, config_vars
         else:
-            logging.error("ERROR: Failed to retrieve config vars using curl:")
-            logging.error(result.stderr)  # Log the error message from curl
+            logger.error("ERROR: Failed to retrieve config vars using curl:")
+            logger.error(result.stderr)  # Log the error message from curl
     except subprocess.CalledProcessError as e:
-        logging.error("ERROR: Error occurred while executing curl:", e)
+        logger.error("ERROR: Error occurred while executing curl: %s", e)
 
     return None, None
 
@@ -113,49 +162,51 @@ def get_heroku_env_vars(app_name="urban-robot-dev"):
     using python requests
     Retrieves heroku env vars from a single heroku app
     :param app_name: string
-    :return: pandas data frame with heroku env vars, and json with heroku env vars
+    :return: dict of heroku env vars (config var name -> value)
+    :raises requests.RequestException: if the request still fails after retries
     """
     app_name = str(app_name)
     url = f"https://api.heroku.com/apps/{app_name}/config-vars"
 
     # request will fail without an API token in env vars
-    assert HEROKU_API_TOKEN is not None, "HEROKU_API_KEY environment variable is not set"
-    # Set headers for Heroku API
-    headers = {
-        "Accept": "application/vnd.heroku+json; version=3",
-        "Authorization": f"Bearer {HEROKU_API_TOKEN.strip()}",
-    }
-
-    with Session() as session:
-        req = Request('GET', url, headers=headers)
-        prepped = session.prepare_request(req)
-        prepped.headers.pop('User-Agent', None)
-        prepped.headers.pop('Accept-Encoding', None)
-        prepped.headers.pop('Connection', None)
+    if _HEROKU_HEADERS is None:
+        raise RuntimeError("HEROKU_API_KEY environment variable is not set")
 
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("url: %s", url)
+        # dump the headers we are about to send, without the bearer token
+        logger.debug("headers: %s", {**_HEROKU_HEADERS, "Authorization": "Bearer <redacted>"})
 
-        response = session.send(prepped)
-        # Debugging: Print the raw headers (should not contain User-Agent)
-        print(response.request.headers)
+    # Make the API request
+    response = _SESSION.get(url, headers=_HEROKU_HEADERS, timeout=HTTP_TIMEOUT)
 
-        # Make the API request
-        logging.warning(f"url: {url}")
-        # response = requests.get(url, headers=headers)
-        logging.warning("check request headers")
-        logging.warning(response.request.headers)
+    response.raise_for_status()  # Check for HTTP request errors
+    return _decode_json(response)
 
-        # Check if the request was successful & return result
-        config_vars = response.json()
-        if response.status_code == 200:
-            df = pd.DataFrame.from_dict(config_vars, orient="index", columns=[app_name])
-            return df, config_vars
-        elif response.status_code == 401 and response.json()["id"] == "unauthorized":
-            logging.error(f"ERROR: {response.status_code} - {config_vars["id"]}: {config_vars["message"]}")
-            logging.error(f"{CURL_CLI_TEST_CMD}\n")
-        else:
-            logging.error("ERROR: Failed to retrieve config vars:", response.status_code, config_vars)
 
-        return None, None
+def get_heroku_env_vars_with_fallback(app_name="urban-robot-dev"):
+    """
+    Retrieves heroku env vars from a single heroku app with python requests,
+    retrying once with curl if that fails (requests has failed against Heroku where curl worked)
+    :param app_name: string
+    :return: dict of heroku env vars (config var name -> value)
+    :raises requests.RequestException: the original requests error, if the curl fallback also fails
+    """
+    try:
+        return get_heroku_env_vars(app_name)
+    except requests.RequestException as e:
+        # a rejected token fails the same way over curl
+        if e.response is not None and e.response.status_code == 401:
+            raise
+        logger.warning("requests failed for Heroku app name: %s (%s), retrying with curl", app_name, e)
+        try:
+            _, config_vars = get_heroku_env_vars_with_curl(app_name)
+        except (RuntimeError, ValueError) as curl_error:
+            logger.error("ERROR: curl fallback failed: %s", curl_error)
+            config_vars = None
+        if config_vars is None:
+            raise
+        return config_vars
 
 
 def get_circleci_env_vars_keys(circleci_app_name=CIRCLECI_DEFAULT_APP):
@@ -169,31 +220,33 @@ def get_circleci_env_vars_keys(circleci_app_name=CIRCLECI_DEFAULT_APP):
     }
 
     try:
-        return get_circleci_env_vars_keys_values_to_df(CIRCLECI_API_URL, headers)
+        return get_circleci_env_vars_keys_values_to_df(_SESSION, CIRCLECI_API_URL, headers)
     except requests.RequestException as e:
-        logging.error(f"An error occurred: {e}")
+        logger.error("An error occurred: %s", e)
         return None, None
 
 
 # TODO Rename this here and in `get_circleci_env_vars`
-def get_circleci_env_vars_keys_values_to_df(CIRCLECI_API_URL, headers):
-    response = requests.get(CIRCLECI_API_URL, headers=headers)
+def get_circleci_env_vars_keys_values_to_df(session, CIRCLECI_API_URL, headers):
+    response = session.get(CIRCLECI_API_URL, headers=headers, timeout=HTTP_TIMEOUT)
     response.raise_for_status()  # Check for HTTP request errors
-    payload_data = response.json().get('items', [])
+    payload_data = _decode_json(response).get('items', [])
 
-    df_circleci = pd.DataFrame(payload_data).fillna("not_set")
-    df_circleci.set_index('name', inplace=True)
-    df_circleci.columns = [f'CIRCLECI_{col}' for col in df_circleci.columns]
-    df_circleci = df_circleci[["CIRCLECI_created_at", "CIRCLECI_value"]]
+    # build only the two columns we report, straight from the payload (missing / null -> NOT_SET)
+    names = [item['name'] for item in payload_data]
+    created = [NOT_SET if item.get('created_at') is None else item['created_at'] for item in payload_data]
+    values = [NOT_SET if item.get('value') is None else item['value'] for item in payload_data]
+    df_circleci = pd.DataFrame({"CIRCLECI_created_at": created, "CIRCLECI_value": values},
+                               index=pd.Index(names, name='name'))
 
-    logging.info(df_circleci)
+    logger.info("%s", df_circleci)
     return df_circleci, payload_data  # Return DataFrame and raw data
 
 
 def get_all_vars_into_matrix(heroku_app_targets=HEROKU_APPS):
     """
-    Loops through Heroku app names, retrieves environment variables,
-    concatenates them into a single DataFrame, and replaces NaNs with "not_set".
+    Retrieves environment variables for each Heroku app (concurrently, alongside local + CircleCI),
+    combines them into a single DataFrame, and marks vars missing from a source as "not_set".
 
     Args:
         heroku_app_targets (list, optional): List of Heroku app names. Defaults to HEROKU_APPS.
@@ -201,32 +254,49 @@ def get_all_vars_into_matrix(heroku_app_targets=HEROKU_APPS):
     Returns:
         pd.DataFrame: DataFrame containing all environment variables for each app.
     """
-    # first column is our required env vars
-    df_required = pd.DataFrame(index=REQUIRED_ENV_VARS, columns=["REQUIRED_ENV_VARS"])
-    df_required["REQUIRED_ENV_VARS"] = "Yes"
-    all_dataframes = [df_required]
-    # second col is env vars in our local environment
-    df_local, _ = get_local_env_vars()
-    all_dataframes.append(df_local)
-
-    df_circleci, _ = get_circleci_env_vars_keys("urban-robot")
-    all_dataframes.append(df_circleci)
-
-    # get Heroku env vars
-    for app_name in heroku_app_targets:
-        # Get DataFrame for the current app (using curl version since Requests is strangely failing)
-        df_app_vars, _ = get_heroku_env_vars_with_curl(app_name)
-
-        if df_app_vars is not None:
-            # Handle missing values (replace NaN with "not_set")
-            # df_app_vars = df_app_vars.fillna("not_set")
-            # Append the DataFrame to the list
-            all_dataframes.append(df_app_vars)
-
-        else:
-            print(f"ERROR: for Heroku app name: {app_name}.  Check Heroku API login credentials.\n")
-    df_final = pd.concat(all_dataframes, axis=1).fillna("not_set")
-    return df_final.groupby('REQUIRED_ENV_VARS', group_keys=False).apply(lambda x: x.sort_index(), include_groups=False)
+    # all sources are independent network / env reads, so fetch them concurrently on one pool;
+    # the shared _SESSION is safe to use from several threads for plain GETs
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_FETCHES, len(heroku_app_targets) + 2)) as executor:
+        local_future = executor.submit(get_local_env_vars)
+        circleci_future = executor.submit(get_circleci_env_vars_keys, "urban-robot")
+        heroku_futures = {app_name: executor.submit(get_heroku_env_vars_with_fallback, app_name)
+                          for app_name in heroku_app_targets}
+
+        # first column is our required env vars, second col is env vars in our local environment
+        _, env_vars_data = local_future.result()
+        columns = {
+            "REQUIRED_ENV_VARS": dict.fromkeys(_REQUIRED_INDEX, "Yes"),
+            # unset local vars come back as None; drop them so they show as "not_set" below
+            "local": {var: value for var, value in env_vars_data.items() if value is not None},
+        }
+
+        df_circleci, _ = circleci_future.result()
+        if df_circleci is not None:
+            columns.update(df_circleci.to_dict())
+
+        # get Heroku env vars; collected in heroku_app_targets order so columns stay deterministic
+        for app_name, future in heroku_futures.items():
+            try:
+                columns[app_name] = future.result()
+            except requests.RequestException as e:
+                if e.response is not None and e.response.status_code == 401:
+                    logger.error("ERROR: for Heroku app name: %s.  Check Heroku API login credentials. %s", app_name, e)
+                    logger.error("%s\n", CURL_CLI_TEST_CMD)
+                else:
+                    logger.error("ERROR: failed to retrieve config vars for Heroku app name: %s. %s", app_name, e)
+
+    # rows: required env vars first, then everything else found in any source, each block sorted
+    other_keys = sorted(set().union(*columns.values()).difference(_REQUIRED_SET))
+    all_keys = _REQUIRED_INDEX.tolist() + other_keys
+
+    # the shape is fixed once all_keys is known, so build every column as a plain list aligned to
+    # all_keys and hand the dict-of-lists to pandas once: no concat, reindex or fillna pass.
+    # missing vars get NOT_SET as each column is built
+    matrix_columns = {name: [source.get(key, NOT_SET) for key in all_keys] for name, source in columns.items()}
+    # store the Yes / not_set flag column as int8 category codes instead of repeated strings
+    matrix_columns["REQUIRED_ENV_VARS"] = pd.Categorical(matrix_columns["REQUIRED_ENV_VARS"],
+                                                         dtype=_REQUIRED_FLAG_DTYPE)
+    return pd.DataFrame(matrix_columns, index=all_keys)
 
 
 if __name__ == "__main__":